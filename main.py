@@ -1,17 +1,32 @@
+import time
+
+# Instante de arranque del proceso, para medir el tiempo hasta estar listo
+BOOT_STARTED_AT = time.perf_counter()
+
+from abc import ABC, abstractmethod
+import asyncio
+import base64
+import html
+import importlib
+import importlib.util
 import logging
 import os
+import shutil
+import sqlite3
 import tempfile
+import threading
+from collections import OrderedDict
 import json
 from datetime import datetime, timedelta
 import pytz
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import openai
-import google.generativeai as genai
-from todoist_api_python.api import TodoistAPI
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from dotenv import load_dotenv
 import re
 
+# Los SDK de OpenAI, Gemini y Todoist se importan bajo demanda (ver load_backend_module)
+IMPORTS_DONE_AT = time.perf_counter()
+
 # Cargar variables de entorno
 load_dotenv('config.env')
 
@@ -27,10 +42,93 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 TODOIST_API_TOKEN = os.getenv('TODOIST_API_TOKEN')
+# Clave Fernet para cifrar los tokens de Todoist vinculados por cada usuario con /link
+TOKEN_ENCRYPTION_KEY = os.getenv('TOKEN_ENCRYPTION_KEY')
 
 # Configurar zona horaria
 TIMEZONE = pytz.timezone('America/Bogota')  # UTM-5
 
+# Ventana (segundos) para agrupar ráfagas de mensajes del mismo usuario. 0 desactiva la agrupación.
+COALESCE_WINDOW_SECONDS = float(os.getenv('COALESCE_WINDOW_SECONDS', '3'))
+
+# Transcripción por fragmentos para notas de voz largas (requiere ffmpeg en el sistema)
+LONG_AUDIO_THRESHOLD_SECONDS = float(os.getenv('LONG_AUDIO_THRESHOLD_SECONDS', '180'))
+AUDIO_CHUNK_SECONDS = float(os.getenv('AUDIO_CHUNK_SECONDS', '60'))
+AUDIO_CHUNK_OVERLAP_SECONDS = float(os.getenv('AUDIO_CHUNK_OVERLAP_SECONDS', '1.5'))
+TRANSCRIPTION_FANOUT = int(os.getenv('TRANSCRIPTION_FANOUT', '4'))
+
+# Motor de transcripción: 'openai', 'local' (faster-whisper en CPU), 'stub' (pruebas) o 'auto'
+# En modo 'auto' las notas de hasta LOCAL_SPEECH_MAX_SECONDS se transcriben localmente y el resto en OpenAI
+SPEECH_BACKEND = os.getenv('SPEECH_BACKEND', 'openai').lower()
+LOCAL_SPEECH_MAX_SECONDS = float(os.getenv('LOCAL_SPEECH_MAX_SECONDS', '60'))
+LOCAL_SPEECH_MODEL = os.getenv('LOCAL_SPEECH_MODEL', 'small')
+LOCAL_SPEECH_LANGUAGE = os.getenv('LOCAL_SPEECH_LANGUAGE', 'es')
+SPEECH_STUB_TEXT = os.getenv('SPEECH_STUB_TEXT', 'Recordar comprar leche mañana, prioridad alta')
+
+# Intervalo mínimo (segundos) entre ediciones del mensaje de progreso
+PROGRESS_EDIT_INTERVAL_SECONDS = float(os.getenv('PROGRESS_EDIT_INTERVAL_SECONDS', '1.0'))
+
+# Cola persistente (SQLite en modo WAL) para crear tareas en Todoist en segundo plano
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'todista.db')
+TASK_QUEUE_WORKERS = int(os.getenv('TASK_QUEUE_WORKERS', '2'))
+TASK_QUEUE_BATCH_SIZE = int(os.getenv('TASK_QUEUE_BATCH_SIZE', '5'))
+TASK_QUEUE_MAX_ATTEMPTS = int(os.getenv('TASK_QUEUE_MAX_ATTEMPTS', '8'))
+TASK_QUEUE_POLL_SECONDS = float(os.getenv('TASK_QUEUE_POLL_SECONDS', '5'))
+# Tiempo que se conservan las tareas ya creadas o fallidas antes de borrarlas de la cola
+TASK_QUEUE_RETENTION_SECONDS = float(os.getenv('TASK_QUEUE_RETENTION_SECONDS', '604800'))
+
+# Pool LRU de clientes de Todoist por usuario y presupuesto de peticiones de cada uno
+TODOIST_POOL_SIZE = int(os.getenv('TODOIST_POOL_SIZE', '256'))
+TODOIST_CONNECTIONS_PER_CLIENT = int(os.getenv('TODOIST_CONNECTIONS_PER_CLIENT', '4'))
+TODOIST_RATE_LIMIT_REQUESTS = int(os.getenv('TODOIST_RATE_LIMIT_REQUESTS', '450'))
+TODOIST_RATE_LIMIT_WINDOW_SECONDS = float(os.getenv('TODOIST_RATE_LIMIT_WINDOW_SECONDS', '900'))
+
+# Despachador de updates: concurrente entre usuarios y en orden para cada usuario
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+DISPATCHER_QUEUE_WARNING_DEPTH = int(os.getenv('DISPATCHER_QUEUE_WARNING_DEPTH', '20'))
+DISPATCHER_METRICS_INTERVAL_SECONDS = float(os.getenv('DISPATCHER_METRICS_INTERVAL_SECONDS', '60'))
+
+# Precargar los SDK en segundo plano una vez que el bot ya está recibiendo mensajes
+PREWARM_BACKENDS = os.getenv('PREWARM_BACKENDS', '1') == '1'
+
+# Ráfagas en espera por usuario: {user_id: {'items': [(tipo, contenido)], 'update': Update, 'timer': Task, 'progress': ProgressMessage}}
+pending_bursts = {}
+
+# Módulos de SDK ya importados: {nombre: módulo}
+backend_modules = {}
+
+def load_backend_module(name: str):
+    """Importa un SDK la primera vez que se usa y registra cuánto tardó"""
+    module = backend_modules.get(name)
+    if module is None:
+        started_at = time.perf_counter()
+        module = importlib.import_module(name)
+        backend_modules[name] = module
+        logger.info(f"⏱️ Import de {name}: {(time.perf_counter() - started_at) * 1000:.0f} ms")
+    return module
+
+async def load_backend_modules(*names: str) -> None:
+    """Importa en un hilo los SDK que falten, para que el primer uso no bloquee el bucle de eventos"""
+    for name in names:
+        if name not in backend_modules:
+            await asyncio.to_thread(load_backend_module, name)
+
+def get_openai():
+    """Devuelve el SDK de OpenAI configurado"""
+    openai = load_backend_module('openai')
+    openai.api_key = OPENAI_API_KEY
+    return openai
+
+def get_genai():
+    """Devuelve el SDK de Google Gemini configurado"""
+    genai = load_backend_module('google.generativeai')
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai
+
+def get_todoist_api(token: str, session=None):
+    """Crea un cliente de Todoist importando el SDK bajo demanda"""
+    return load_backend_module('todoist_api_python.api').TodoistAPI(token, session=session)
+
 def get_current_date():
     """Obtiene la fecha actual en formato dd-mm-yyyy en UTM-5"""
     return datetime.now(TIMEZONE).strftime('%d-%m-%Y')
@@ -95,7 +193,22 @@ if not all([TELEGRAM_TOKEN, OPENAI_API_KEY, GEMINI_API_KEY]):
     exit(1)
 
 if not TODOIST_API_TOKEN or TODOIST_API_TOKEN == "TU_TODOIST_API_TOKEN_AQUI":
-    logger.warning("⚠️ TODOIST_API_TOKEN no configurado. Las tareas no se crearán en Todoist.")
+    TODOIST_API_TOKEN = None
+    logger.warning("⚠️ TODOIST_API_TOKEN no configurado. Solo se crearán tareas para usuarios vinculados con /link.")
+
+if not TOKEN_ENCRYPTION_KEY:
+    logger.warning("⚠️ TOKEN_ENCRYPTION_KEY no configurada. El comando /link estará desactivado.")
+else:
+    # Una clave Fernet son 32 bytes en base64 url-safe; validarla aquí evita fallos en cada petición
+    try:
+        valid_key = len(base64.urlsafe_b64decode(TOKEN_ENCRYPTION_KEY.encode())) == 32
+    except Exception:
+        valid_key = False
+    if not valid_key:
+        logger.error("❌ TOKEN_ENCRYPTION_KEY no es una clave Fernet válida. Verifica config.env")
+        exit(1)
+    if TODOIST_API_TOKEN:
+        logger.warning("⚠️ Modo multiusuario activo: TODOIST_API_TOKEN se ignora, cada usuario debe usar /link.")
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Maneja el comando /start"""
@@ -107,7 +220,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "📋 <b>Comandos disponibles:</b>\n"
         "• /start - Mensaje de bienvenida\n"
         "• /help - Ver ayuda detallada\n"
-        "• /tasks [fecha] - Ver tareas de un día\n\n"
+        "• /tasks [fecha] - Ver tareas de un día\n"
+        "• /tasks semana - Ver tareas de los próximos 7 días\n"
+        "• /link [token] - Vincular tu cuenta de Todoist\n\n"
         "🎵 <b>Envía una nota de voz</b> o <b>escribe texto</b> para crear tareas."
     )
 
@@ -149,6 +264,11 @@ Convierte tus notas de voz en tareas organizadas automáticamente usando IA.
 • /start - Mensaje de bienvenida
 • /help - Esta ayuda
 • /tasks [fecha] - Ver tareas de un día específico
+• /tasks semana - Tareas de los próximos 7 días
+• /tasks 20/10..27/10 - Tareas de un rango de días
+• /tasks vencidas - Tareas vencidas
+• /link [token] - Vincular tu propia cuenta de Todoist
+• /unlink - Desvincular tu cuenta de Todoist
 
 <b>🔧 Soporte:</b>
 Si tienes problemas, verifica:
@@ -160,103 +280,170 @@ Si tienes problemas, verifica:
     
     await update.message.reply_html(help_text)
 
+# Máximo de días que se pueden consultar de una vez con /tasks
+TASKS_MAX_RANGE_DAYS = 31
+
+# Límite de caracteres de un mensaje de Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+WEEKDAY_NAMES = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+
+TASKS_USAGE_TEXT = (
+    "❌ Formato de fecha no reconocido.\n\n"
+    "Formatos válidos:\n"
+    "• /tasks hoy\n"
+    "• /tasks mañana\n"
+    "• /tasks 2024-10-23\n"
+    "• /tasks 23/10/2024\n"
+    "• /tasks semana\n"
+    "• /tasks vencidas\n"
+    "• /tasks 20/10..27/10"
+)
+
+def parse_tasks_day(day_str: str, now=None):
+    """Convierte un día de /tasks (hoy, mañana, ayer, dd/mm, dd-mm-yyyy...) en fecha YYYY-MM-DD"""
+    if now is None:
+        now = datetime.now(TIMEZONE)
+    day_str = day_str.strip().lower()
+    if day_str in ['ayer', 'yesterday']:
+        return (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    # Día y mes sin año: usar el año actual
+    for sep in ['/', '-']:
+        try:
+            parsed_date = datetime.strptime(f"{day_str}{sep}{now.year}", f"%d{sep}%m{sep}%Y")
+            return parsed_date.strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return parse_natural_date(day_str, now)
+
+def parse_tasks_query(arg: str, now=None):
+    """Interpreta el argumento de /tasks y devuelve (filtro de Todoist, días del rango) o None si no es válido.
+
+    Para 'vencidas' los días son None: las tareas se agrupan por su propia fecha.
+    """
+    if now is None:
+        now = datetime.now(TIMEZONE)
+    arg = arg.strip().lower()
+    
+    if arg in ['vencidas', 'atrasadas', 'overdue']:
+        return 'overdue', None
+    
+    if arg in ['semana', 'week']:
+        start = now.strftime('%Y-%m-%d')
+        end = (now + timedelta(days=6)).strftime('%Y-%m-%d')
+    elif '..' in arg:
+        start_str, end_str = arg.split('..', 1)
+        start = parse_tasks_day(start_str, now)
+        end = parse_tasks_day(end_str, now)
+    else:
+        start = end = parse_tasks_day(arg or 'hoy', now)
+    
+    if not start or not end:
+        return None
+    
+    start_date = datetime.strptime(start, '%Y-%m-%d')
+    end_date = datetime.strptime(end, '%Y-%m-%d')
+    if end_date < start_date or (end_date - start_date).days >= TASKS_MAX_RANGE_DAYS:
+        return None
+    
+    days = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end_date - start_date).days + 1)]
+    # Una sola consulta para todo el rango
+    return ' | '.join(f"due: {day}" for day in days), days
+
+def format_task_entry(i: int, task, projects: dict) -> str:
+    """Construye la línea HTML de una tarea de Todoist para /tasks"""
+    text = f"{i}. <b>{task.content}</b>\n"
+    if task.description:
+        text += f"   📄 {task.description}\n"
+    if task.priority:
+        priority_text = {1: "Baja", 2: "Media", 3: "Alta", 4: "Muy Alta"}.get(task.priority, "Sin prioridad")
+        text += f"   ⚡ Prioridad: {priority_text}\n"
+    if task.project_id and task.project_id in projects:
+        text += f"   📁 Proyecto: {projects[task.project_id]}\n"
+    text += f"   🔗 <a href='https://todoist.com/app/task/{task.id}'>Ver en Todoist</a>\n\n"
+    return text
+
 async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Maneja el comando /tasks para mostrar tareas de un día específico"""
-    if not TODOIST_API_TOKEN or TODOIST_API_TOKEN == "TU_TODOIST_API_TOKEN_AQUI":
-        await update.message.reply_text("❌ Token de Todoist no configurado.")
+    """Maneja el comando /tasks para mostrar tareas de un día, un rango de días o las vencidas"""
+    client = await get_todoist_client(update.effective_user.id)
+    if client is None:
+        await update.message.reply_text("❌ Token de Todoist no configurado. Vincula tu cuenta con /link <token>.")
         return
     
-    # Obtener fecha del comando (opcional)
-    args = context.args
-    target_date = None
-    
-    if args:
-        date_arg = " ".join(args)
-        # Procesar diferentes formatos de fecha
-        if date_arg.lower() in ['hoy', 'today']:
-            target_date = get_current_date_iso()
-        elif date_arg.lower() in ['mañana', 'tomorrow']:
-            target_date = (datetime.now(TIMEZONE) + timedelta(days=1)).strftime('%Y-%m-%d')
-        elif date_arg.lower() in ['ayer', 'yesterday']:
-            target_date = (datetime.now(TIMEZONE) - timedelta(days=1)).strftime('%Y-%m-%d')
-        else:
-            # Intentar parsear fecha específica
-            try:
-                # Priorizar formato dd-mm-yyyy
-                for fmt in ['%d-%m-%Y', '%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y']:
-                    try:
-                        parsed_date = datetime.strptime(date_arg, fmt)
-                        target_date = parsed_date.strftime('%Y-%m-%d')
-                        break
-                    except ValueError:
-                        continue
-                
-                if not target_date:
-                    await update.message.reply_text(
-                        "❌ Formato de fecha no reconocido.\n\n"
-                        "Formatos válidos:\n"
-                        "• /tasks hoy\n"
-                        "• /tasks mañana\n"
-                        "• /tasks 2024-10-23\n"
-                        "• /tasks 23/10/2024"
-                    )
-                    return
-            except:
-                await update.message.reply_text(
-                    "❌ Formato de fecha no reconocido.\n\n"
-                    "Formatos válidos:\n"
-                    "• /tasks hoy\n"
-                    "• /tasks mañana\n"
-                    "• /tasks 2024-10-23\n"
-                    "• /tasks 23/10/2024"
-                )
-                return
-    else:
-        # Si no se especifica fecha, usar hoy
-        target_date = get_current_date_iso()
+    # Obtener fecha o rango del comando (opcional, por defecto hoy)
+    query = parse_tasks_query(" ".join(context.args or []))
+    if query is None:
+        await update.message.reply_text(TASKS_USAGE_TEXT)
+        return
+    task_filter, days = query
     
     try:
-        api = TodoistAPI(TODOIST_API_TOKEN)
-        
-        # Obtener tareas
-        tasks = api.get_tasks()
+        # Filtrar en el servidor de Todoist en lugar de descargar todas las tareas
+        tasks = await client.call('get_tasks', filter=task_filter)
         
-        # Filtrar tareas por fecha
-        filtered_tasks = []
+        # Agrupar por día
+        tasks_by_day = {}
         for task in tasks:
-            if task.due and task.due.date == target_date:
-                filtered_tasks.append(task)
+            if task.due:
+                tasks_by_day.setdefault(task.due.date[:10], []).append(task)
+        if days is None:
+            days = sorted(tasks_by_day)
         
-        if not filtered_tasks:
+        if not tasks:
             # Convertir fecha ISO a formato dd-mm-yyyy para mostrar
-            display_date = datetime.strptime(target_date, '%Y-%m-%d').strftime('%d-%m-%Y')
+            if task_filter == 'overdue':
+                empty_title = "No hay tareas vencidas"
+            elif len(days) == 1:
+                empty_title = f"No hay tareas para el {datetime.strptime(days[0], '%Y-%m-%d').strftime('%d-%m-%Y')}"
+            else:
+                empty_title = (
+                    f"No hay tareas del {datetime.strptime(days[0], '%Y-%m-%d').strftime('%d-%m-%Y')} "
+                    f"al {datetime.strptime(days[-1], '%Y-%m-%d').strftime('%d-%m-%Y')}"
+                )
             await update.message.reply_text(
-                f"📅 <b>No hay tareas para el {display_date}</b>\n\n"
+                f"📅 <b>{empty_title}</b>\n\n"
                 "¡Disfruta tu día libre! 🎉",
                 parse_mode='HTML'
             )
             return
         
+        # Nombres de proyecto con una sola llamada
+        projects = {}
+        if any(task.project_id for task in tasks):
+            try:
+                projects = {project.id: project.name for project in await client.call('get_projects')}
+            except Exception as e:
+                logger.warning(f"No se pudieron obtener los proyectos: {str(e)}")
+        
         # Construir respuesta
-        display_date = datetime.strptime(target_date, '%Y-%m-%d').strftime('%d-%m-%Y')
-        response_text = f"📅 <b>Tareas para el {display_date}:</b>\n\n"
-        
-        for i, task in enumerate(filtered_tasks, 1):
-            response_text += f"{i}. <b>{task.content}</b>\n"
-            if task.description:
-                response_text += f"   📄 {task.description}\n"
-            if task.priority:
-                priority_text = {1: "Baja", 2: "Media", 3: "Alta", 4: "Muy Alta"}.get(task.priority, "Sin prioridad")
-                response_text += f"   ⚡ Prioridad: {priority_text}\n"
-            if task.project_id:
-                try:
-                    project = api.get_project(task.project_id)
-                    response_text += f"   📁 Proyecto: {project.name}\n"
-                except:
-                    pass
-            response_text += f"   🔗 <a href='https://todoist.com/app/task/{task.id}'>Ver en Todoist</a>\n\n"
+        if task_filter == 'overdue':
+            response_text = "⏰ <b>Tareas vencidas:</b>\n\n"
+        elif len(days) == 1:
+            display_date = datetime.strptime(days[0], '%Y-%m-%d').strftime('%d-%m-%Y')
+            response_text = f"📅 <b>Tareas para el {display_date}:</b>\n\n"
+        else:
+            response_text = (
+                f"📅 <b>Tareas del {datetime.strptime(days[0], '%Y-%m-%d').strftime('%d-%m-%Y')} "
+                f"al {datetime.strptime(days[-1], '%Y-%m-%d').strftime('%d-%m-%Y')}:</b>\n\n"
+            )
         
-        response_text += f"📊 <b>Total: {len(filtered_tasks)} tareas</b>"
+        single_day = task_filter != 'overdue' and len(days) == 1
+        for day in days:
+            day_tasks = tasks_by_day.get(day)
+            if not day_tasks:
+                continue
+            if not single_day:
+                day_date = datetime.strptime(day, '%Y-%m-%d')
+                response_text += f"🗓️ <b>{WEEKDAY_NAMES[day_date.weekday()]} {day_date.strftime('%d-%m-%Y')}</b>\n\n"
+            for i, task in enumerate(day_tasks, 1):
+                response_text += format_task_entry(i, task, projects)
+        
+        footer = f"📊 <b>Total: {len(tasks)} tareas</b>"
+        if len(response_text) + len(footer) > TELEGRAM_MESSAGE_LIMIT:
+            # Cortar en la última tarea completa que cabe en un mensaje
+            cut = response_text.rfind("\n\n", 0, TELEGRAM_MESSAGE_LIMIT - len(footer) - 50)
+            response_text = response_text[:cut + 2] + "✂️ <i>Lista recortada...</i>\n\n"
+        response_text += footer
         
         await update.message.reply_text(response_text, parse_mode='HTML', disable_web_page_preview=True)
         
@@ -267,119 +454,498 @@ async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "Verifica que tu token de Todoist sea válido."
         )
 
+class ProgressMessage:
+    """Mensaje de estado único que se edita en segundo plano mientras avanza el procesamiento"""
+    
+    def __init__(self, reply_to):
+        self._reply_to = reply_to
+        self._send_task = None
+        self._edit_task = None
+        self._pending_text = None
+        self._last_edit = 0.0
+        self._throttling = False
+        self._finished = False
+    
+    def start(self, text: str) -> None:
+        """Envía el mensaje inicial sin bloquear el procesamiento"""
+        self._send_task = asyncio.create_task(self._reply_to.reply_text(text))
+    
+    def update(self, text: str) -> None:
+        """Programa una edición; si llegan varias seguidas solo se envía la más reciente"""
+        if self._finished:
+            return
+        self._pending_text = text
+        if self._edit_task is None or self._edit_task.done():
+            self._edit_task = asyncio.create_task(self._edit_loop())
+    
+    async def _edit_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            message = await self._send_task
+        except Exception as e:
+            logger.warning(f"No se pudo enviar el mensaje de progreso: {str(e)}")
+            return
+        while self._pending_text is not None and not self._finished:
+            # Respetar el intervalo mínimo entre ediciones (límite por chat de Telegram)
+            wait = self._last_edit + PROGRESS_EDIT_INTERVAL_SECONDS - loop.time()
+            if wait > 0:
+                self._throttling = True
+                try:
+                    await asyncio.sleep(wait)
+                finally:
+                    self._throttling = False
+                continue
+            text, self._pending_text = self._pending_text, None
+            try:
+                await message.edit_text(text)
+            except Exception as e:
+                logger.debug(f"Edición de progreso omitida: {str(e)}")
+            self._last_edit = loop.time()
+    
+    async def finish(self, text: str, **kwargs) -> None:
+        """Reemplaza el mensaje de progreso por el resultado final"""
+        self._finished = True
+        self._pending_text = None
+        if self._edit_task and not self._edit_task.done():
+            if self._throttling:
+                # Descartar la edición intermedia que estaba esperando turno
+                self._edit_task.cancel()
+            else:
+                # Dejar terminar la edición en curso para no pisar el resultado final
+                await asyncio.gather(self._edit_task, return_exceptions=True)
+        
+        try:
+            message = await self._send_task
+        except Exception:
+            await self._reply_to.reply_text(text, **kwargs)
+            return
+        await message.edit_text(text, **kwargs)
+
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Maneja las notas de voz recibidas"""
     voice = update.message.voice
     
     if voice:
-        # Información de la nota de voz
-        file_id = voice.file_id
-        duration = voice.duration
-        file_size = voice.file_size
-        
-        await update.message.reply_text(
-            f"🎵 Nota de voz recibida!\n\n"
-            f"📊 Información:\n"
-            f"• Duración: {duration} segundos\n"
-            f"• Tamaño: {file_size} bytes\n"
-            f"• ID del archivo: {file_id}\n\n"
-            f"Procesando tu nota de voz..."
-        )
-        
-        # Aquí puedes agregar la lógica para procesar la nota de voz
-        # Por ejemplo: transcribir, guardar, analizar, etc.
         await process_voice_note(update, context, voice)
     else:
         await update.message.reply_text("No se pudo procesar la nota de voz.")
 
 async def process_voice_note(update: Update, context: ContextTypes.DEFAULT_TYPE, voice) -> None:
-    """Procesa la nota de voz usando OpenAI Whisper para transcripción"""
+    """Encola la nota de voz en la ráfaga del usuario para procesarla junto a los mensajes cercanos"""
+    await queue_burst_message(update, context, 'voice', voice)
+
+def transcribe_audio_file(path: str) -> str:
+    """Transcribe un archivo de audio con OpenAI Whisper (llamada bloqueante)"""
+    with open(path, 'rb') as audio_file:
+        transcript = get_openai().audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            response_format="text"
+        )
+    return (transcript or '').strip()
+
+# Modelo local cargado una sola vez dentro del proceso trabajador
+_local_speech_model = None
+
+def _init_local_speech_model(model_size: str) -> None:
+    """Carga el modelo de faster-whisper cuantizado a int8 en el proceso trabajador"""
+    global _local_speech_model
+    from faster_whisper import WhisperModel
+    _local_speech_model = WhisperModel(model_size, device='cpu', compute_type='int8')
+
+def _local_speech_ping() -> bool:
+    """Confirma que el proceso trabajador ya tiene el modelo cargado"""
+    return _local_speech_model is not None
+
+def _local_speech_transcribe(path: str, language: str) -> str:
+    """Transcribe un archivo con el modelo local ya cargado (se ejecuta en el proceso trabajador)"""
+    segments, _ = _local_speech_model.transcribe(path, language=language or None, vad_filter=True)
+    return ' '.join(segment.text.strip() for segment in segments).strip()
+
+class SpeechBackend(ABC):
+    """Interfaz común para los motores de transcripción de voz"""
+    name = 'base'
+    # Indica si conviene dividir las notas largas en fragmentos paralelos
+    parallel_chunks = False
+    
+    @abstractmethod
+    async def transcribe(self, path: str) -> str:
+        """Transcribe el archivo de audio y devuelve el texto"""
+    
+    def close(self) -> None:
+        """Libera los recursos del motor (procesos, conexiones) al apagar el bot"""
+
+class OpenAISpeechBackend(SpeechBackend):
+    """Transcripción remota con la API de OpenAI Whisper"""
+    name = 'openai'
+    parallel_chunks = True
+    
+    async def transcribe(self, path: str) -> str:
+        # Ejecutar en un hilo para poder transcribir varias notas a la vez
+        return await asyncio.to_thread(transcribe_audio_file, path)
+
+class LocalSpeechBackend(SpeechBackend):
+    """Transcripción en CPU con faster-whisper; el modelo queda cargado en un proceso trabajador"""
+    name = 'local'
+    
+    def __init__(self, model_size: str, language: str):
+        self.model_size = model_size
+        self.language = language
+        self._executor = None
+    
+    @staticmethod
+    def is_available() -> bool:
+        return importlib.util.find_spec('faster_whisper') is not None
+    
+    def _get_executor(self):
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # 'spawn' en lugar de 'fork': el proceso ya tiene hilos (to_thread, HTTP) y un fork con
+            # hilos vivos puede dejar bloqueado al hijo
+            self._executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_local_speech_model,
+                initargs=(self.model_size,)
+            )
+        return self._executor
+    
+    def _reset_executor(self) -> None:
+        """Descarta un pool roto (fallo al cargar el modelo, falta de memoria) para recrearlo en la siguiente nota"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    async def warm_up(self) -> None:
+        """Arranca el proceso trabajador para que el modelo esté cargado antes de la primera nota"""
+        from concurrent.futures.process import BrokenProcessPool
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._get_executor(), _local_speech_ping)
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise
+    
+    async def transcribe(self, path: str) -> str:
+        from concurrent.futures.process import BrokenProcessPool
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), _local_speech_transcribe, path, self.language)
+        except BrokenProcessPool as e:
+            self._reset_executor()
+            logger.error(f"El motor local de transcripción falló, usando OpenAI para esta nota: {str(e)}")
+            return await get_speech_backend('openai').transcribe(path)
+    
+    def close(self) -> None:
+        self._reset_executor()
+
+class StubSpeechBackend(SpeechBackend):
+    """Transcripción determinista para pruebas, sin llamadas externas"""
+    name = 'stub'
+    
+    async def transcribe(self, path: str) -> str:
+        return SPEECH_STUB_TEXT
+
+# Instancias de motores creadas bajo demanda
+speech_backends = {}
+
+def get_speech_backend(name: str) -> SpeechBackend:
+    """Devuelve (creándola si hace falta) la instancia del motor de transcripción indicado"""
+    if name not in speech_backends:
+        if name == 'local':
+            speech_backends[name] = LocalSpeechBackend(LOCAL_SPEECH_MODEL, LOCAL_SPEECH_LANGUAGE)
+        elif name == 'stub':
+            speech_backends[name] = StubSpeechBackend()
+        else:
+            speech_backends[name] = OpenAISpeechBackend()
+    return speech_backends[name]
+
+def select_speech_backend(duration) -> SpeechBackend:
+    """Elige el motor de transcripción según la configuración y la duración de la nota"""
+    name = SPEECH_BACKEND
+    if name == 'auto':
+        name = 'local' if duration is not None and duration <= LOCAL_SPEECH_MAX_SECONDS else 'openai'
+    if name == 'local' and not LocalSpeechBackend.is_available():
+        logger.warning("⚠️ faster-whisper no está instalado. Usando OpenAI para transcribir.")
+        name = 'openai'
+    return get_speech_backend(name)
+
+async def transcribe_voice_note(context: ContextTypes.DEFAULT_TYPE, voice) -> str:
+    """Descarga una nota de voz y la transcribe con el motor configurado"""
+    backend = select_speech_backend(voice.duration)
+    
+    file = await context.bot.get_file(voice.file_id)
+    
+    # Crear archivo temporal para guardar el audio
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
+        temp_file_path = temp_file.name
+    
     try:
-        # Configurar OpenAI
-        openai.api_key = OPENAI_API_KEY
+        # Descargar el archivo
+        await file.download_to_drive(temp_file_path)
         
-        # Descargar el archivo de audio
-        await update.message.reply_text("📥 Descargando nota de voz...")
+        # Las notas largas se dividen en fragmentos que se transcriben en paralelo
+        if (backend.parallel_chunks and voice.duration and voice.duration >= LONG_AUDIO_THRESHOLD_SECONDS
+                and shutil.which('ffmpeg')):
+            try:
+                return await transcribe_long_audio(backend, temp_file_path, voice.duration)
+            except Exception as e:
+                logger.warning(f"Fallo la transcripción por fragmentos, usando archivo completo: {str(e)}")
         
-        file = await context.bot.get_file(voice.file_id)
+        return await backend.transcribe(temp_file_path)
+    finally:
+        # Limpiar archivo temporal
+        os.unlink(temp_file_path)
+
+async def run_ffmpeg(*args: str) -> str:
+    """Ejecuta ffmpeg con los argumentos dados y devuelve su salida de error (donde escribe sus reportes)"""
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-nostdin', *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Cancelar la espera no detiene ffmpeg: matarlo para que no siga escribiendo el fragmento
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg terminó con código {process.returncode}")
+    return stderr.decode('utf-8', errors='ignore')
+
+async def detect_silences(path: str) -> list:
+    """Detecta los silencios del audio y devuelve el punto medio de cada uno en segundos"""
+    output = await run_ffmpeg('-i', path, '-af', 'silencedetect=noise=-30dB:d=0.4', '-f', 'null', '-')
+    silences = []
+    for match in re.finditer(r'silence_end: ([\d.]+) \| silence_duration: ([\d.]+)', output):
+        end, duration = float(match.group(1)), float(match.group(2))
+        silences.append(end - duration / 2)
+    return silences
+
+def plan_audio_chunks(duration: float, silences: list) -> list:
+    """Calcula los fragmentos (inicio, fin) cortando en el silencio más cercano a cada límite, con solapamiento"""
+    cuts = []
+    last_cut = 0.0
+    tolerance = AUDIO_CHUNK_SECONDS * 0.25
+    # El último fragmento puede ser hasta un 25% más largo para no dejar colas diminutas
+    while duration - last_cut > AUDIO_CHUNK_SECONDS * 1.25:
+        target = last_cut + AUDIO_CHUNK_SECONDS
+        candidates = [s for s in silences if abs(s - target) <= tolerance and s > last_cut]
+        cut = min(candidates, key=lambda s: abs(s - target)) if candidates else target
+        cuts.append(cut)
+        last_cut = cut
+    
+    bounds = [0.0] + cuts + [float(duration)]
+    return [
+        (max(0.0, bounds[i] - AUDIO_CHUNK_OVERLAP_SECONDS), min(float(duration), bounds[i + 1] + AUDIO_CHUNK_OVERLAP_SECONDS))
+        for i in range(len(bounds) - 1)
+    ]
+
+def stitch_transcripts(parts: list) -> str:
+    """Une las transcripciones de los fragmentos eliminando las palabras repetidas por el solapamiento"""
+    def normalize(word):
+        return re.sub(r'[^\w]', '', word.lower())
+    
+    words = []
+    for part in parts:
+        part_words = part.split()
+        # Buscar el solapamiento más largo entre el final acumulado y el inicio del fragmento
+        max_overlap = min(len(words), len(part_words), 15)
+        # Mínimo 2 palabras: una sola coincidencia ("que", "de") suele ser casualidad, no solapamiento
+        for k in range(max_overlap, 1, -1):
+            if [normalize(w) for w in words[-k:]] == [normalize(w) for w in part_words[:k]]:
+                part_words = part_words[k:]
+                break
+        words.extend(part_words)
+    return ' '.join(words)
+
+async def transcribe_long_audio(backend: SpeechBackend, path: str, duration: float) -> str:
+    """Divide el audio en silencios y transcribe los fragmentos de forma concurrente"""
+    silences = await detect_silences(path)
+    chunks = plan_audio_chunks(duration, silences)
+    semaphore = asyncio.Semaphore(max(1, TRANSCRIPTION_FANOUT))
+    chunk_paths = []
+    
+    async def transcribe_chunk(start, end):
+        # El archivo temporal y la extracción van dentro del semáforo: no se lanza un ffmpeg por fragmento
+        # a la vez y ningún fragmento cancelado llega a crear su archivo
+        async with semaphore:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
+                chunk_path = temp_file.name
+            chunk_paths.append(chunk_path)
+            await run_ffmpeg('-y', '-v', 'error', '-ss', f'{start:.2f}', '-t', f'{end - start:.2f}', '-i', path, '-c', 'copy', chunk_path)
+            return await backend.transcribe(chunk_path)
+    
+    try:
+        logger.info(f"Transcribiendo audio de {duration}s en {len(chunks)} fragmentos")
+        # Si un fragmento falla, el TaskGroup cancela y espera al resto antes de limpiar los archivos
+        async with asyncio.TaskGroup() as group:
+            chunk_tasks = [group.create_task(transcribe_chunk(start, end)) for start, end in chunks]
+        parts = [task.result() for task in chunk_tasks]
+    except ExceptionGroup as e:
+        # Propagar el error del fragmento para que el llamador lo registre y use el archivo completo
+        raise e.exceptions[0]
+    finally:
+        for chunk_path in chunk_paths:
+            if os.path.exists(chunk_path):
+                os.unlink(chunk_path)
+    
+    return stitch_transcripts([part for part in parts if part])
+
+async def queue_burst_message(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, payload) -> None:
+    """Agrega un mensaje (texto o voz) a la ráfaga del usuario y reinicia la ventana de espera"""
+    user_id = update.effective_user.id
+    burst = pending_bursts.get(user_id)
+    
+    if burst is None:
+        # Un solo mensaje de progreso por ráfaga, que luego mostrará el resultado
+        progress = ProgressMessage(update.message)
+        if kind == 'voice':
+            progress.start(f"🎵 Nota de voz recibida ({payload.duration} segundos). Procesando...")
+        else:
+            progress.start("📝 Mensaje recibido. Procesando...")
+        burst = {'items': [], 'update': update, 'timer': None, 'progress': progress}
+    else:
+        burst['progress'].update(f"📥 {len(burst['items']) + 1} mensajes recibidos. Procesando...")
+    
+    burst['items'].append((kind, payload))
+    # Responder siempre al último mensaje de la ráfaga
+    burst['update'] = update
+    
+    if COALESCE_WINDOW_SECONDS <= 0:
+        await process_message_burst(update, context, burst['items'], burst['progress'])
+        return
+    
+    pending_bursts[user_id] = burst
+    if burst['timer']:
+        burst['timer'].cancel()
+    burst['timer'] = context.application.create_task(flush_message_burst(user_id, context))
+
+async def flush_message_burst(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Espera a que termine la ventana de agrupación y procesa la ráfaga completa"""
+    await asyncio.sleep(COALESCE_WINDOW_SECONDS)
+    
+    # Sacar la ráfaga antes de procesarla para que los mensajes nuevos abran otra
+    burst = pending_bursts.pop(user_id, None)
+    if not burst:
+        return
+    
+    # Procesar en la cola del usuario para no coincidir con sus botones o ediciones
+    await run_in_user_order(
+        context.application,
+        user_id,
+        process_message_burst(burst['update'], context, burst['items'], burst['progress'])
+    )
+
+def format_tasks_list(tasks: list) -> str:
+    """Construye el listado HTML de tareas identificadas"""
+    text = ""
+    for i, task in enumerate(tasks, 1):
+        text += f"{i}. <b>{task.get('title', 'Sin título')}</b>\n"
+        if task.get('description'):
+            text += f"   📄 {task['description']}\n"
+        if task.get('priority'):
+            text += f"   ⚡ Prioridad: {task['priority']}\n"
+        if task.get('due_date'):
+            text += f"   📅 Fecha: {task['due_date']}\n"
+        if task.get('category'):
+            text += f"   🏷️ Categoría: {task['category']}\n"
+        text += "\n"
+    return text
+
+async def process_message_burst(update: Update, context: ContextTypes.DEFAULT_TYPE, items: list, progress: ProgressMessage) -> None:
+    """Transcribe las notas de voz de la ráfaga en paralelo y extrae las tareas con una sola llamada a Gemini"""
+    try:
+        voice_indexes = [i for i, (kind, _) in enumerate(items) if kind == 'voice']
         
-        # Crear archivo temporal para guardar el audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
-            temp_file_path = temp_file.name
+        if voice_indexes:
+            progress.update(f"🎤 Transcribiendo {len(voice_indexes)} nota(s) de voz con Whisper...")
         
-        # Descargar el archivo
-        await file.download_to_drive(temp_file_path)
+        # Transcribir todas las notas de voz de forma concurrente
+        transcripts = await asyncio.gather(
+            *(transcribe_voice_note(context, items[i][1]) for i in voice_indexes),
+            return_exceptions=True
+        )
+        transcript_by_index = dict(zip(voice_indexes, transcripts))
         
-        await update.message.reply_text("🎤 Transcribiendo audio con Whisper...")
+        # Reconstruir el texto en el orden de llegada
+        parts = []
+        failed_voice_notes = 0
+        for i, (kind, payload) in enumerate(items):
+            if kind == 'voice':
+                transcript = transcript_by_index[i]
+                if isinstance(transcript, Exception):
+                    logger.error(f"Error transcribiendo nota de voz: {str(transcript)}")
+                    failed_voice_notes += 1
+                    continue
+                if transcript:
+                    parts.append(transcript)
+            elif payload and payload.strip():
+                parts.append(payload.strip())
         
-        # Transcribir usando OpenAI Whisper
-        with open(temp_file_path, 'rb') as audio_file:
-            transcript = openai.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text"
+        if not parts:
+            await progress.finish(
+                "❌ No se pudo transcribir el audio. "
+                "Asegúrate de que el audio sea claro y contenga habla."
             )
+            return
         
-        # Limpiar archivo temporal
-        os.unlink(temp_file_path)
+        text = "\n".join(parts)
         
-        if transcript and transcript.strip():
-            # Enviar transcripción al usuario
-            await update.message.reply_text(
-                f"📝 **Transcripción:**\n\n{transcript.strip()}\n\n"
-                f"🔄 Procesando con Gemini..."
-            )
-            
-            # Procesar texto con Gemini
-            gemini_result = await process_text_with_gemini(transcript.strip())
+        if voice_indexes:
+            progress.update(f"📝 Transcripción:\n\n{text}\n\n🔄 Procesando con Gemini...")
+        
+        # Procesar todo el texto con una sola llamada a Gemini
+        gemini_result = await process_text_with_gemini(text)
+        
+        if voice_indexes:
+            response_text = f"📝 <b>Transcripción:</b>\n\n{text}\n\n"
+        else:
+            response_text = f"📝 <b>Texto procesado:</b>\n\n{text}\n\n"
+        
+        # Avisar de las notas de voz que se perdieron en lugar de descartarlas en silencio
+        if failed_voice_notes == 1:
+            response_text += "⚠️ 1 nota de voz no se pudo transcribir\n\n"
+        elif failed_voice_notes > 1:
+            response_text += f"⚠️ {failed_voice_notes} notas de voz no se pudieron transcribir\n\n"
+        
+        if gemini_result.get("tasks"):
+            # Guardar tareas en el contexto para confirmación posterior
+            context.user_data['pending_tasks'] = gemini_result["tasks"]
             
-            # Construir respuesta con el análisis
-            response_text = f"📝 <b>Transcripción:</b>\n\n{transcript.strip()}\n\n"
+            response_text += "📋 <b>Tareas Identificadas:</b>\n\n"
+            response_text += format_tasks_list(gemini_result["tasks"])
+            response_text += "🔘 <b>Usa los botones para confirmar o editar las tareas:</b>"
             
-            if gemini_result.get("tasks"):
-                response_text += "📋 <b>Tareas Identificadas:</b>\n\n"
-                
-                # Guardar tareas en el contexto para confirmación posterior
-                context.user_data['pending_tasks'] = gemini_result["tasks"]
-                
-                for i, task in enumerate(gemini_result["tasks"], 1):
-                    response_text += f"{i}. <b>{task.get('title', 'Sin título')}</b>\n"
-                    if task.get('description'):
-                        response_text += f"   📄 {task['description']}\n"
-                    if task.get('priority'):
-                        response_text += f"   ⚡ Prioridad: {task['priority']}\n"
-                    if task.get('due_date'):
-                        response_text += f"   📅 Fecha: {task['due_date']}\n"
-                    if task.get('category'):
-                        response_text += f"   🏷️ Categoría: {task['category']}\n"
-                    response_text += "\n"
-                
-                response_text += "🔘 <b>Usa los botones para confirmar o editar las tareas:</b>"
-                
-                # Crear botones interactivos
-                keyboard = create_task_confirmation_keyboard(gemini_result["tasks"], update.effective_user.id)
-                
-                await update.message.reply_text(response_text, parse_mode='HTML', reply_markup=keyboard)
-                        
-            else:
-                response_text += "📋 <b>Análisis:</b>\n\n"
-                response_text += f"{gemini_result.get('summary', 'No se pudo analizar el texto')}\n\n"
-                response_text += "✅ Procesamiento completado exitosamente!"
-                
-                await update.message.reply_text(response_text, parse_mode='HTML')
+            # Crear botones interactivos
+            keyboard = create_task_confirmation_keyboard(gemini_result["tasks"], update.effective_user.id)
             
-            logger.info(f"Procesamiento completo exitoso para usuario {update.effective_user.id}")
+            await progress.finish(response_text, parse_mode='HTML', reply_markup=keyboard)
+        elif voice_indexes:
+            response_text += "📋 <b>Análisis:</b>\n\n"
+            response_text += f"{gemini_result.get('summary', 'No se pudo analizar el texto')}\n\n"
+            response_text += "✅ Procesamiento completado exitosamente!"
             
+            await progress.finish(response_text, parse_mode='HTML')
         else:
-            await update.message.reply_text(
-                "❌ No se pudo transcribir el audio. "
-                "Asegúrate de que el audio sea claro y contenga habla."
+            await progress.finish(
+                "❌ No se identificaron tareas en el texto.\n\n"
+                "💡 <b>Ejemplos de texto válido:</b>\n"
+                "• 'Comprar leche mañana, alta prioridad'\n"
+                "• 'Terminar proyecto para el viernes'\n"
+                "• 'Llamar al médico el lunes por la mañana'",
+                parse_mode='HTML'
             )
-            
+        
+        logger.info(f"Ráfaga de {len(items)} mensaje(s) procesada para usuario {update.effective_user.id}")
+        
     except Exception as e:
-        logger.error(f"Error procesando nota de voz: {str(e)}")
-        await update.message.reply_text(
-            f"❌ Error al procesar la nota de voz: {str(e)}\n\n"
+        logger.error(f"Error procesando ráfaga de mensajes: {str(e)}")
+        await progress.finish(
+            f"❌ Error al procesar tus mensajes: {str(e)}\n\n"
             "Verifica que tu API key de OpenAI sea válida y tengas créditos disponibles."
         )
 
@@ -387,7 +953,8 @@ async def process_text_with_gemini(text: str) -> dict:
     """Procesa el texto transcrito con Google Gemini para estructurar tareas"""
     try:
         # Configurar Gemini
-        genai.configure(api_key=GEMINI_API_KEY)
+        await load_backend_modules('google.generativeai')
+        genai = get_genai()
         model = genai.GenerativeModel('gemini-1.5-pro')
         
         # Prompt para estructurar tareas
@@ -453,10 +1020,250 @@ async def process_text_with_gemini(text: str) -> dict:
             "error": str(e)
         }
 
-async def create_todoist_task(task_data: dict) -> dict:
-    """Crea una tarea en Todoist basada en los datos estructurados"""
+class RateBudget:
+    """Presupuesto de peticiones tipo cubeta de fichas (límite de Todoist por cuenta)"""
+    
+    def __init__(self, capacity: int, window_seconds: float):
+        self.capacity = capacity
+        self.refill_per_second = capacity / window_seconds
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+    
+    async def acquire(self) -> None:
+        """Espera hasta que haya presupuesto para una petición y lo consume"""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.refill_per_second)
+
+class TodoistClient:
+    """Cliente de Todoist de un usuario, con su propia sesión HTTP y presupuesto de peticiones"""
+    
+    def __init__(self, token: str):
+        requests = load_backend_module('requests')
+        self.session = requests.Session()
+        # Reutilizar pocas conexiones por usuario para acotar los sockets abiertos
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=TODOIST_CONNECTIONS_PER_CLIENT)
+        self.session.mount('https://', adapter)
+        self.api = get_todoist_api(token, session=self.session)
+        self.budget = RateBudget(TODOIST_RATE_LIMIT_REQUESTS, TODOIST_RATE_LIMIT_WINDOW_SECONDS)
+    
+    async def call(self, method: str, *args, **kwargs):
+        """Ejecuta un método del SDK en un hilo respetando el presupuesto del usuario"""
+        await self.budget.acquire()
+        return await asyncio.to_thread(getattr(self.api, method), *args, **kwargs)
+    
+    def close(self) -> None:
+        self.session.close()
+
+class TodoistClientPool:
+    """Pool LRU acotado de clientes de Todoist por usuario"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+    
+    def get(self, key):
+        client = self._clients.get(key)
+        if client is not None:
+            self._clients.move_to_end(key)
+        return client
+    
+    def put(self, key, client: TodoistClient) -> None:
+        replaced = self._clients.get(key)
+        if replaced is not None and replaced is not client:
+            replaced.close()
+        self._clients[key] = client
+        self._clients.move_to_end(key)
+        # Cerrar las sesiones de los clientes menos usados recientemente
+        while len(self._clients) > self.max_size:
+            _, evicted = self._clients.popitem(last=False)
+            evicted.close()
+    
+    def discard(self, key) -> None:
+        client = self._clients.pop(key, None)
+        if client is not None:
+            client.close()
+    
+    def close_all(self) -> None:
+        while self._clients:
+            _, client = self._clients.popitem()
+            client.close()
+
+class TokenStore:
+    """Tokens de Todoist vinculados por cada usuario, guardados cifrados en SQLite"""
+    
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_tokens (
+                    user_id INTEGER PRIMARY KEY,
+                    encrypted_token TEXT NOT NULL,
+                    linked_at REAL NOT NULL
+                )
+            """)
+    
+    def save(self, user_id: int, encrypted_token: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_tokens (user_id, encrypted_token, linked_at) VALUES (?, ?, ?)",
+                (user_id, encrypted_token, time.time())
+            )
+    
+    def load(self, user_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT encrypted_token FROM user_tokens WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def delete(self, user_id: int) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM user_tokens WHERE user_id = ?", (user_id,))
+        return cursor.rowcount > 0
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+todoist_clients = TodoistClientPool(TODOIST_POOL_SIZE)
+# Cliente compartido (TODOIST_API_TOKEN, solo en modo de una cuenta), almacén de tokens y cifrador
+shared_todoist_clients = {}
+token_stores = {}
+token_ciphers = {}
+
+def get_token_store() -> TokenStore:
+    """Devuelve el almacén de tokens, abriéndolo si hace falta"""
+    if 'default' not in token_stores:
+        token_stores['default'] = TokenStore(DATABASE_PATH)
+    return token_stores['default']
+
+def get_token_cipher():
+    """Devuelve el cifrador Fernet de tokens, o None si no hay clave configurada"""
+    if not TOKEN_ENCRYPTION_KEY:
+        return None
+    if 'default' not in token_ciphers:
+        token_ciphers['default'] = load_backend_module('cryptography.fernet').Fernet(TOKEN_ENCRYPTION_KEY)
+    return token_ciphers['default']
+
+async def get_todoist_client(user_id: int):
+    """Devuelve el cliente de Todoist del usuario.
+
+    En modo multiusuario (TOKEN_ENCRYPTION_KEY) solo se usan cuentas vinculadas con /link: si el
+    token no está (por ejemplo, tras perder el disco) se devuelve None para pedir que vuelva a
+    vincular, nunca la cuenta compartida. Sin clave se usa siempre TODOIST_API_TOKEN.
+    """
+    client = todoist_clients.get(user_id)
+    if client is not None:
+        return client
+    
+    await load_backend_modules('requests', 'todoist_api_python.api')
+    if TOKEN_ENCRYPTION_KEY:
+        await load_backend_modules('cryptography.fernet')
+    cipher = get_token_cipher()
+    if cipher is not None:
+        encrypted_token = await asyncio.to_thread(get_token_store().load, user_id)
+        # Otra petición del mismo usuario pudo crear el cliente mientras se leía el token
+        client = todoist_clients.get(user_id)
+        if client is not None:
+            return client
+        if encrypted_token:
+            try:
+                token = cipher.decrypt(encrypted_token.encode()).decode()
+            except Exception as e:
+                # Clave de cifrado cambiada o dato corrupto: el usuario debe volver a vincular
+                logger.error(f"No se pudo descifrar el token del usuario {user_id}: {str(e)}")
+                return None
+            client = TodoistClient(token)
+            todoist_clients.put(user_id, client)
+            return client
+        return None
+    
+    if not TODOIST_API_TOKEN:
+        return None
+    if 'default' not in shared_todoist_clients:
+        shared_todoist_clients['default'] = TodoistClient(TODOIST_API_TOKEN)
+    return shared_todoist_clients['default']
+
+async def link_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /link para vincular la cuenta de Todoist del usuario"""
+    if not TOKEN_ENCRYPTION_KEY:
+        await update.message.reply_text("❌ La vinculación de cuentas no está habilitada en este bot.")
+        return
+    await load_backend_modules('cryptography.fernet', 'requests', 'todoist_api_python.api')
+    cipher = get_token_cipher()
+    
+    if not context.args:
+        await update.message.reply_text(
+            "🔗 Uso: /link <token de Todoist>\n\n"
+            "Obtén tu token en: https://todoist.com/app/settings/integrations/developer"
+        )
+        return
+    
+    token = context.args[0].strip()
+    user_id = update.effective_user.id
+    
+    # Borrar el mensaje para no dejar el token visible en el chat
+    try:
+        await update.message.delete()
+    except Exception as e:
+        logger.warning(f"No se pudo borrar el mensaje con el token: {str(e)}")
+    
+    # En grupos el bot puede no tener permiso para borrar, así que solo se acepta en privado
+    if update.effective_chat.type != 'private':
+        await context.bot.send_message(
+            update.effective_chat.id,
+            "⚠️ Por seguridad, usa /link solo en un chat privado con el bot. "
+            "Si el mensaje con tu token sigue visible, bórralo y genera un token nuevo en Todoist."
+        )
+        return
+    
+    # Comprobar que el token es válido antes de guardarlo
+    client = TodoistClient(token)
+    try:
+        await client.call('get_projects')
+    except Exception as e:
+        client.close()
+        logger.warning(f"Token de Todoist inválido para usuario {user_id}: {str(e)}")
+        await context.bot.send_message(update.effective_chat.id, "❌ El token de Todoist no es válido.")
+        return
+    
+    await asyncio.to_thread(get_token_store().save, user_id, cipher.encrypt(token.encode()).decode())
+    todoist_clients.put(user_id, client)
+    
+    await context.bot.send_message(
+        update.effective_chat.id,
+        "✅ Cuenta de Todoist vinculada. Tus tareas se crearán en tu cuenta."
+    )
+
+async def unlink_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Maneja el comando /unlink para desvincular la cuenta de Todoist del usuario"""
+    user_id = update.effective_user.id
+    todoist_clients.discard(user_id)
+    removed = await asyncio.to_thread(get_token_store().delete, user_id)
+    
+    if removed:
+        await update.message.reply_text("✅ Cuenta de Todoist desvinculada.")
+    else:
+        await update.message.reply_text("ℹ️ No tenías ninguna cuenta de Todoist vinculada.")
+
+async def create_todoist_task(task_data: dict, user_id: int, request_id: str = None) -> dict:
+    """Crea una tarea en Todoist basada en los datos estructurados.
+
+    request_id se envía como cabecera X-Request-Id para que Todoist descarte los reintentos de una
+    petición que ya procesó (por ejemplo, si creó la tarea pero la respuesta se perdió).
+    """
     try:
-        api = TodoistAPI(TODOIST_API_TOKEN)
+        client = await get_todoist_client(user_id)
+        if client is None:
+            raise RuntimeError("Token de Todoist no configurado. Vincula tu cuenta con /link <token>")
         
         # Preparar datos de la tarea
         content = task_data.get('title', 'Tarea sin título') or 'Tarea sin título'
@@ -489,12 +1296,14 @@ async def create_todoist_task(task_data: dict) -> dict:
         # Log para debugging
         logger.info(f"Creando tarea: content='{content}', description='{description}', due_date='{due_date}', priority={priority}")
         
-        # Crear la tarea
-        task = api.add_task(
+        # Crear la tarea con el cliente y el presupuesto de peticiones del usuario
+        task = await client.call(
+            'add_task',
             content=content,
             description=description,
             due_date=due_date,
-            priority=priority
+            priority=priority,
+            request_id=request_id
         )
         
         return {
@@ -575,6 +1384,209 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         task_index = int(data.split("_")[3])
         await keep_original_task(update, context, user_id, task_index)
 
+class TaskQueue:
+    """Cola local persistente (SQLite en modo WAL) de tareas confirmadas pendientes de crear en Todoist"""
+    
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS task_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    task_json TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    task_url TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_task_queue_status ON task_queue (status, next_attempt_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_task_queue_message ON task_queue (chat_id, message_id)")
+            # Devolver a la cola las tareas que quedaron a medias si el proceso se detuvo
+            self._conn.execute("UPDATE task_queue SET status = 'pending' WHERE status = 'processing'")
+    
+    def enqueue(self, user_id: int, chat_id: int, message_id: int, tasks: list) -> None:
+        """Guarda las tareas (posición, datos) de un mensaje en una sola transacción"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO task_queue (user_id, chat_id, message_id, position, task_json, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(user_id, chat_id, message_id, position, json.dumps(task), now) for position, task in tasks]
+                )
+    
+    def claim_batch(self, limit: int) -> list:
+        """Reserva hasta `limit` tareas listas para procesar"""
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute(
+                    "SELECT * FROM task_queue WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (time.time(), limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE task_queue SET status = 'processing' WHERE id = ?",
+                    [(row['id'],) for row in rows]
+                )
+        return [dict(row) for row in rows]
+    
+    def mark_done(self, row_id: int, task_url: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE task_queue SET status = 'done', task_url = ?, error = NULL WHERE id = ?",
+                (task_url, row_id)
+            )
+    
+    def mark_failed_attempt(self, row_id: int, attempts: int, error: str) -> None:
+        """Programa un reintento con espera exponencial o marca la tarea como fallida"""
+        status = 'failed' if attempts >= TASK_QUEUE_MAX_ATTEMPTS else 'pending'
+        next_attempt_at = time.time() + min(300, 2 ** attempts)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE task_queue SET status = ?, attempts = ?, next_attempt_at = ?, error = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, error, row_id)
+            )
+    
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """Borra las tareas ya creadas o fallidas más antiguas que el periodo de retención"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM task_queue WHERE status IN ('done', 'failed') AND created_at < ?",
+                (time.time() - older_than_seconds,)
+            )
+        return cursor.rowcount
+    
+    def message_rows(self, chat_id: int, message_id: int) -> list:
+        """Devuelve todas las tareas encoladas desde un mismo mensaje, en orden"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM task_queue WHERE chat_id = ? AND message_id = ? ORDER BY position",
+                (chat_id, message_id)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# Cola abierta bajo demanda y evento para despertar a los trabajadores
+task_queues = {}
+task_queue_wakeup = asyncio.Event()
+# Candados por mensaje (chat_id, message_id) para que las ediciones de estado no se adelanten unas a otras
+task_queue_message_locks = {}
+
+def get_task_queue() -> TaskQueue:
+    """Devuelve la cola persistente de tareas, abriéndola si hace falta"""
+    if 'default' not in task_queues:
+        task_queues['default'] = TaskQueue(DATABASE_PATH)
+    return task_queues['default']
+
+async def enqueue_confirmed_tasks(query, user_id: int, tasks: list) -> bool:
+    """Encola las tareas confirmadas y responde al instante con su estado"""
+    message = query.message
+    try:
+        await asyncio.to_thread(get_task_queue().enqueue, user_id, message.chat_id, message.message_id, tasks)
+    except Exception as e:
+        logger.error(f"Error guardando tareas en la cola: {str(e)}")
+        await query.edit_message_text(f"❌ No se pudieron guardar las tareas: {str(e)}\n\nIntenta confirmar de nuevo.")
+        return False
+    task_queue_wakeup.set()
+    
+    await refresh_task_queue_message(query.get_bot(), message.chat_id, message.message_id)
+    return True
+
+async def refresh_task_queue_message(bot, chat_id: int, message_id: int) -> None:
+    """Edita el mensaje con el estado actual de sus tareas, una edición a la vez por mensaje"""
+    key = (chat_id, message_id)
+    lock = task_queue_message_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Leer el estado ya con el candado, para que la última edición siempre sea la más reciente
+        rows = await asyncio.to_thread(get_task_queue().message_rows, chat_id, message_id)
+        try:
+            await bot.edit_message_text(
+                format_task_queue_status(rows),
+                chat_id=chat_id,
+                message_id=message_id,
+                parse_mode='HTML',
+                disable_web_page_preview=True
+            )
+        except Exception as e:
+            if 'Message is not modified' not in str(e):
+                logger.warning(f"No se pudo actualizar el estado de la cola: {str(e)}")
+    
+    # El estado final ya no cambia: el candado deja de ser necesario
+    if all(row['status'] in ('done', 'failed') for row in rows) and not lock.locked():
+        task_queue_message_locks.pop(key, None)
+
+def format_task_queue_status(rows: list) -> str:
+    """Construye el estado en Todoist de las tareas encoladas desde un mensaje"""
+    response_text = "📱 <b>Estado en Todoist:</b>\n\n"
+    for i, row in enumerate(rows, 1):
+        title = html.escape(json.loads(row['task_json']).get('title') or 'Sin título')
+        if row['status'] == 'done':
+            response_text += f"{i}. ✅ <b>{title}</b>\n"
+            response_text += f"   🔗 <a href='{row['task_url']}'>Ver tarea</a>\n\n"
+        elif row['status'] == 'failed':
+            response_text += f"{i}. ❌ <b>{title}</b>\n   {html.escape(row['error'] or '')}\n\n"
+        elif row['attempts']:
+            response_text += f"{i}. 🔁 <b>{title}</b> (reintento {row['attempts']})\n\n"
+        else:
+            response_text += f"{i}. ⏳ <b>{title}</b> en cola\n\n"
+    
+    if all(row['status'] in ('done', 'failed') for row in rows):
+        response_text += "✅ <b>Todas las tareas procesadas!</b>"
+    else:
+        response_text += "⏳ <b>Creando tareas en Todoist...</b>"
+    return response_text
+
+async def task_queue_worker(application: Application) -> None:
+    """Vacía la cola por lotes, reintenta los fallos y actualiza el mensaje del chat"""
+    queue = get_task_queue()
+    last_purge_at = 0.0
+    while True:
+        task_queue_wakeup.clear()
+        rows = await asyncio.to_thread(queue.claim_batch, TASK_QUEUE_BATCH_SIZE)
+        if not rows:
+            # Aprovechar los ratos libres para limpiar tareas antiguas, como mucho una vez por hora
+            if time.monotonic() - last_purge_at >= 3600:
+                last_purge_at = time.monotonic()
+                purged = await asyncio.to_thread(queue.purge_finished, TASK_QUEUE_RETENTION_SECONDS)
+                if purged:
+                    logger.info(f"🧹 {purged} tareas antiguas eliminadas de la cola")
+            try:
+                await asyncio.wait_for(task_queue_wakeup.wait(), timeout=TASK_QUEUE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        # Id de petición estable por fila: los reintentos de la misma tarea no la duplican en Todoist
+        results = await asyncio.gather(*(
+            create_todoist_task(json.loads(row['task_json']), row['user_id'], f"todista-{row['id']}-{int(row['created_at'])}")
+            for row in rows
+        ))
+        
+        messages = set()
+        for row, result in zip(rows, results):
+            if result["success"]:
+                await asyncio.to_thread(queue.mark_done, row['id'], result['task_url'])
+            else:
+                await asyncio.to_thread(queue.mark_failed_attempt, row['id'], row['attempts'] + 1, result['message'])
+            messages.add((row['chat_id'], row['message_id']))
+        
+        # Mostrar los enlaces a medida que las tareas llegan a Todoist
+        for chat_id, message_id in messages:
+            await refresh_task_queue_message(application.bot, chat_id, message_id)
+
 async def confirm_all_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
     """Confirma todas las tareas pendientes"""
     query = update.callback_query
@@ -586,27 +1598,12 @@ async def confirm_all_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await query.edit_message_text("❌ No hay tareas pendientes para confirmar.")
         return
     
-    # Crear todas las tareas en Todoist
-    results = []
-    for task in tasks_data:
-        result = await create_todoist_task(task)
-        results.append(result)
-    
-    # Construir respuesta
-    response_text = "📱 <b>Estado en Todoist:</b>\n\n"
-    for i, result in enumerate(results, 1):
-        if result["success"]:
-            response_text += f"{i}. ✅ {result['message']}\n"
-            response_text += f"   🔗 <a href='{result['task_url']}'>Ver tarea</a>\n\n"
-        else:
-            response_text += f"{i}. ❌ {result['message']}\n\n"
-    
-    response_text += "✅ <b>Todas las tareas procesadas!</b>"
-    
-    await query.edit_message_text(response_text, parse_mode='HTML', disable_web_page_preview=True)
-    
-    # Limpiar tareas pendientes
-    context.user_data.pop('pending_tasks', None)
+    # Encolar todas las tareas; se crean en Todoist en segundo plano
+    if await enqueue_confirmed_tasks(query, user_id, list(enumerate(tasks_data))):
+        # Limpiar tareas pendientes solo cuando ya están guardadas en la cola, y solo si no
+        # llegó otra lista nueva mientras tanto
+        if context.user_data.get('pending_tasks') is tasks_data:
+            context.user_data.pop('pending_tasks', None)
 
 async def confirm_single_task(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, task_index: int) -> None:
     """Confirma una tarea específica"""
@@ -618,17 +1615,7 @@ async def confirm_single_task(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text("❌ Tarea no encontrada.")
         return
     
-    task = tasks_data[task_index]
-    result = await create_todoist_task(task)
-    
-    if result["success"]:
-        response_text = f"✅ <b>Tarea creada exitosamente!</b>\n\n"
-        response_text += f"📋 <b>{task.get('title', 'Sin título')}</b>\n"
-        response_text += f"🔗 <a href='{result['task_url']}'>Ver en Todoist</a>"
-    else:
-        response_text = f"❌ <b>Error al crear tarea:</b>\n{result['message']}"
-    
-    await query.edit_message_text(response_text, parse_mode='HTML', disable_web_page_preview=True)
+    await enqueue_confirmed_tasks(query, user_id, [(task_index, tasks_data[task_index])])
 
 async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, task_index: int) -> None:
     """Permite editar una tarea específica"""
@@ -674,6 +1661,88 @@ async def handle_text_edit(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     else:
         await handle_text_task_creation(update, context, text)
 
+# Verbos opcionales al inicio de una corrección ("cambiar la prioridad a alta", "pon fecha mañana")
+EDIT_VERBS = r'(?:cambiar|cambia|cambiale|cambiarle|poner|pon|ponle|ponerle|mover|mueve|muévela|actualizar|actualiza)'
+EDIT_VERB_PATTERN = r'^(?:' + EDIT_VERBS + r'\s+)?'
+
+# Valor de un campo de texto libre: exige ":", "a" o "por" tras el campo, para que "el título está mal"
+# o "la descripción debe incluir..." no se tomen como el nuevo valor
+EDIT_VALUE_PATTERN = r'\s*(?:(?:a|por)\b\s*:?|:)\s*(.+)$'
+
+# Inicio de una corrección, para saber dónde termina la anterior
+EDIT_CLAUSE_START = (
+    r'(?:' + EDIT_VERBS + r'\s+)?(?:(?:la|el)\s+)?(?:prioridad|fecha|categor[ií]a|t[ií]tulo|nombre|descripci[oó]n)\b'
+    r'|(?:sin|quitar|quita)\s+(?:la\s+)?fecha\b|(?:muy\s+)?(?:alta|media|baja)\s+prioridad\b|para\s'
+)
+
+# Separadores entre correcciones: punto y coma, o coma / " y " seguidos de otro campo
+# ("descripción: hola, mundo" es un solo valor)
+EDIT_CLAUSE_SEPARATOR = r'\s*;\s*|(?:\s*,\s*|\s+y\s+)(?=' + EDIT_CLAUSE_START + r')'
+
+def parse_edit_patch(edit_text: str, now=None):
+    """Convierte correcciones simples ("prioridad alta", "fecha mañana", "título: X") en un parche de campos.
+
+    Devuelve None si alguna parte no se reconoce, para que la edición la resuelva Gemini.
+    """
+    patch = {}
+    clauses = [clause.strip().rstrip('.') for clause in re.split(EDIT_CLAUSE_SEPARATOR, edit_text.strip(), flags=re.IGNORECASE)]
+    for clause in clauses:
+        if not clause:
+            continue
+        
+        match = re.match(EDIT_VERB_PATTERN + r'(?:el\s+)?(?:t[ií]tulo|nombre)' + EDIT_VALUE_PATTERN, clause, re.IGNORECASE)
+        if match:
+            patch['title'] = match.group(1).strip().strip('"\'')
+            continue
+        
+        match = re.match(EDIT_VERB_PATTERN + r'(?:la\s+)?descripci[oó]n' + EDIT_VALUE_PATTERN, clause, re.IGNORECASE)
+        if match:
+            patch['description'] = match.group(1).strip().strip('"\'')
+            continue
+        
+        match = (
+            re.match(EDIT_VERB_PATTERN + r'(?:la\s+)?prioridad\s*(?:(?:a|en)\b\s*)?:?\s*(muy alta|muy baja|alta|media|baja)$', clause, re.IGNORECASE)
+            or re.match(EDIT_VERB_PATTERN + r'(muy alta|muy baja|alta|media|baja)\s+prioridad$', clause, re.IGNORECASE)
+        )
+        if match:
+            patch['priority'] = match.group(1).lower()
+            continue
+        
+        if re.match(EDIT_VERB_PATTERN + r'(?:sin|quitar|quita)\s+(?:la\s+)?fecha$', clause, re.IGNORECASE):
+            patch['due_date'] = None
+            continue
+        
+        match = (
+            re.match(EDIT_VERB_PATTERN + r'(?:la\s+)?fecha\s*(?:(?:a|al|para)\b\s*)?:?\s*(?:el\s+)?(.+)$', clause, re.IGNORECASE)
+            or re.match(EDIT_VERB_PATTERN + r'para\s+(?:el\s+)?(.+)$', clause, re.IGNORECASE)
+        )
+        if match:
+            due_date = parse_natural_date(match.group(1), now)
+            if not due_date:
+                return None
+            patch['due_date'] = due_date
+            continue
+        
+        match = re.match(EDIT_VERB_PATTERN + r'(?:la\s+)?categor[ií]a' + EDIT_VALUE_PATTERN, clause, re.IGNORECASE)
+        if match:
+            patch['category'] = match.group(1).strip().lower()
+            continue
+        
+        # Corrección libre: la resuelve Gemini
+        return None
+    
+    return patch or None
+
+def merge_task_patch(task: dict, patch: dict) -> dict:
+    """Aplica un parche de campos a una tarea conservando los campos no mencionados"""
+    merged = dict(task)
+    for field, value in patch.items():
+        if value is None:
+            merged.pop(field, None)
+        else:
+            merged[field] = value
+    return merged
+
 async def handle_task_editing(update: Update, context: ContextTypes.DEFAULT_TYPE, edit_text: str) -> None:
     editing_info = context.user_data.get('editing_task')
     if not editing_info:
@@ -682,12 +1751,18 @@ async def handle_task_editing(update: Update, context: ContextTypes.DEFAULT_TYPE
     task_index = editing_info['index']
     original_task = editing_info['original_task']
     
-    # Procesar el texto de edición con Gemini
-    gemini_result = await process_text_with_gemini(edit_text)
+    # Intentar primero el análisis local de la corrección, sin llamar a Gemini
+    patch = parse_edit_patch(edit_text)
+    
+    if patch is None:
+        # Corrección libre: procesar el texto de edición con Gemini
+        gemini_result = await process_text_with_gemini(edit_text)
+        if gemini_result.get("tasks"):
+            # Usar la primera tarea del resultado, solo con los campos que trae
+            patch = {field: value for field, value in gemini_result["tasks"][0].items() if value}
     
-    if gemini_result.get("tasks"):
-        # Usar la primera tarea del resultado como edición
-        edited_task = gemini_result["tasks"][0]
+    if patch:
+        edited_task = merge_task_patch(original_task, patch)
         
         # Actualizar la tarea en el contexto
         tasks_data = context.user_data.get('pending_tasks', [])
@@ -717,44 +1792,8 @@ async def handle_task_editing(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_text_task_creation(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
     """Maneja la creación de tareas via texto"""
-    # Procesar el texto con Gemini
-    gemini_result = await process_text_with_gemini(text)
-    
-    if gemini_result.get("tasks"):
-        # Guardar tareas en el contexto para confirmación posterior
-        context.user_data['pending_tasks'] = gemini_result["tasks"]
-        
-        # Construir respuesta
-        response_text = f"📝 <b>Texto procesado:</b>\n\n{text}\n\n"
-        response_text += "📋 <b>Tareas Identificadas:</b>\n\n"
-        
-        for i, task in enumerate(gemini_result["tasks"], 1):
-            response_text += f"{i}. <b>{task.get('title', 'Sin título')}</b>\n"
-            if task.get('description'):
-                response_text += f"   📄 {task['description']}\n"
-            if task.get('priority'):
-                response_text += f"   ⚡ Prioridad: {task['priority']}\n"
-            if task.get('due_date'):
-                response_text += f"   📅 Fecha: {task['due_date']}\n"
-            if task.get('category'):
-                response_text += f"   🏷️ Categoría: {task['category']}\n"
-            response_text += "\n"
-        
-        response_text += "🔘 <b>Usa los botones para confirmar o editar las tareas:</b>"
-        
-        # Crear botones interactivos
-        keyboard = create_task_confirmation_keyboard(gemini_result["tasks"], update.effective_user.id)
-        
-        await update.message.reply_text(response_text, parse_mode='HTML', reply_markup=keyboard)
-    else:
-        await update.message.reply_text(
-            "❌ No se identificaron tareas en el texto.\n\n"
-            "💡 <b>Ejemplos de texto válido:</b>\n"
-            "• 'Comprar leche mañana, alta prioridad'\n"
-            "• 'Terminar proyecto para el viernes'\n"
-            "• 'Llamar al médico el lunes por la mañana'",
-            parse_mode='HTML'
-        )
+    # Encolar el texto en la ráfaga del usuario
+    await queue_burst_message(update, context, 'text', text)
 
 async def cancel_all_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
     """Cancela todas las tareas pendientes"""
@@ -780,18 +1819,7 @@ async def cancel_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, user_i
     tasks_data = context.user_data.get('pending_tasks', [])
     if tasks_data:
         response_text = "📋 <b>Tareas Identificadas:</b>\n\n"
-        for i, task in enumerate(tasks_data, 1):
-            response_text += f"{i}. <b>{task.get('title', 'Sin título')}</b>\n"
-            if task.get('description'):
-                response_text += f"   📄 {task['description']}\n"
-            if task.get('priority'):
-                response_text += f"   ⚡ Prioridad: {task['priority']}\n"
-            if task.get('due_date'):
-                response_text += f"   📅 Fecha: {task['due_date']}\n"
-            if task.get('category'):
-                response_text += f"   🏷️ Categoría: {task['category']}\n"
-            response_text += "\n"
-        
+        response_text += format_tasks_list(tasks_data)
         response_text += "🔘 <b>Usa los botones para confirmar o editar las tareas:</b>"
         keyboard = create_task_confirmation_keyboard(tasks_data, user_id)
         
@@ -814,18 +1842,7 @@ async def keep_original_task(update: Update, context: ContextTypes.DEFAULT_TYPE,
     tasks_data = context.user_data.get('pending_tasks', [])
     if tasks_data:
         response_text = "📋 <b>Tareas Identificadas:</b>\n\n"
-        for i, task in enumerate(tasks_data, 1):
-            response_text += f"{i}. <b>{task.get('title', 'Sin título')}</b>\n"
-            if task.get('description'):
-                response_text += f"   📄 {task['description']}\n"
-            if task.get('priority'):
-                response_text += f"   ⚡ Prioridad: {task['priority']}\n"
-            if task.get('due_date'):
-                response_text += f"   📅 Fecha: {task['due_date']}\n"
-            if task.get('category'):
-                response_text += f"   🏷️ Categoría: {task['category']}\n"
-            response_text += "\n"
-        
+        response_text += format_tasks_list(tasks_data)
         response_text += "🔘 <b>Usa los botones para confirmar o editar las tareas:</b>"
         keyboard = create_task_confirmation_keyboard(tasks_data, user_id)
         
@@ -859,15 +1876,228 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     if hasattr(update, 'message') and update.message:
         await update.message.reply_text("❌ Ocurrió un error inesperado. Por favor, intenta de nuevo o contacta soporte.")
 
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Procesa updates en paralelo entre usuarios y en orden estricto para cada usuario.
+
+    Cada usuario tiene su propia cola (una cadena de futuros): un update espera a que termine el
+    anterior del mismo usuario, así pending_tasks y editing_task nunca se modifican a la vez.
+    El límite global solo se aplica a los updates que ya están en ejecución.
+    """
+    
+    # Cota del semáforo de la clase base: tan alta que nunca bloquea, para que cada update llegue a
+    # su cola en orden de llegada; el límite real es self._slots
+    UNBOUNDED = 2 ** 30
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(self.UNBOUNDED)
+        self.max_running = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # Último update encolado por usuario y cantidad de updates en cola o en ejecución
+        self._tails = {}
+        self._depths = {}
+        # Updates sin usuario ni chat (en cola o en ejecución): no pasan por _depths
+        self._unkeyed = 0
+        self.active = 0
+        self.processed = 0
+        self.max_depth = 0
+    
+    @staticmethod
+    def update_key(update: object):
+        """Clave de ordenación del update: el usuario, o el chat si no hay usuario"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+    
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await self.run_for_key(self.update_key(update), coroutine)
+    
+    async def run_for_key(self, key, coroutine) -> None:
+        """Ejecuta la corrutina en la cola de `key`, después de todo lo ya encolado para esa clave"""
+        if key is None:
+            self._unkeyed += 1
+            try:
+                async with self._slots:
+                    await self._run(coroutine)
+            finally:
+                self._unkeyed -= 1
+            return
+        
+        # Encolar sin ningún await previo para conservar el orden de llegada
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        depth = self._depths.get(key, 0) + 1
+        self._depths[key] = depth
+        self.max_depth = max(self.max_depth, depth)
+        if depth >= DISPATCHER_QUEUE_WARNING_DEPTH:
+            logger.warning(f"⚠️ Cola de updates del usuario {key} con {depth} pendientes")
+        
+        started = False
+        try:
+            if previous is not None:
+                # asyncio.wait no cancela el futuro anterior si este update se cancela
+                await asyncio.wait([previous])
+            async with self._slots:
+                started = True
+                await self._run(coroutine)
+        finally:
+            if not started:
+                coroutine.close()
+            self._depths[key] -= 1
+            if previous is None or previous.done():
+                self._release(key, done)
+            else:
+                # Cancelado mientras esperaba: ceder el turno solo cuando termine el anterior,
+                # para que el siguiente update del usuario no se adelante
+                previous.add_done_callback(lambda _: self._release(key, done))
+    
+    def _release(self, key, done) -> None:
+        """Marca el turno como terminado y olvida la cola del usuario si no hay nada detrás"""
+        done.set_result(None)
+        if self._tails.get(key) is done:
+            del self._tails[key]
+            del self._depths[key]
+    
+    async def _run(self, coroutine) -> None:
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+            self.processed += 1
+    
+    def metrics(self) -> dict:
+        """Devuelve las métricas actuales de las colas"""
+        return {
+            'en_ejecucion': self.active,
+            'limite': self.max_running,
+            'en_cola': sum(self._depths.values()) + self._unkeyed - self.active,
+            'usuarios_activos': len(self._depths),
+            'profundidad_maxima_actual': max(self._depths.values(), default=0),
+            'profundidad_maxima': self.max_depth,
+            'procesados': self.processed,
+        }
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+
+async def run_in_user_order(application: Application, user_id: int, coroutine) -> None:
+    """Ejecuta trabajo en segundo plano en la misma cola ordenada que los updates del usuario"""
+    processor = application.update_processor
+    if isinstance(processor, PerUserUpdateProcessor):
+        await processor.run_for_key(user_id, coroutine)
+    else:
+        await coroutine
+
+async def log_dispatcher_metrics(application: Application) -> None:
+    """Registra periódicamente las métricas del despachador mientras haya actividad"""
+    processor = application.update_processor
+    last_processed = None
+    while True:
+        await asyncio.sleep(DISPATCHER_METRICS_INTERVAL_SECONDS)
+        metrics = processor.metrics()
+        if metrics['procesados'] != last_processed or metrics['en_cola']:
+            logger.info("📊 Despachador: " + ", ".join(f"{name}={value}" for name, value in metrics.items()))
+            last_processed = metrics['procesados']
+
+# Marcas de tiempo del arranque (perf_counter) para el desglose de tiempos
+startup_marks = {}
+
+# Tareas en segundo plano del bot (precarga, trabajadores de la cola, métricas); se cancelan al apagar
+background_tasks = set()
+
+def start_background_task(coroutine) -> asyncio.Task:
+    """Lanza una tarea en segundo plano guardando su referencia hasta que termine"""
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def prewarm_backends(application: Application) -> None:
+    """Importa los SDK y prepara el motor local en segundo plano, una vez iniciado el polling"""
+    # Dejar que el polling arranque antes de ocupar CPU con los imports
+    await asyncio.sleep(1)
+    
+    started_at = time.perf_counter()
+    for name in ('openai', 'google.generativeai', 'todoist_api_python.api'):
+        try:
+            await asyncio.to_thread(load_backend_module, name)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precargar {name}: {str(e)}")
+    
+    if SPEECH_BACKEND in ('local', 'auto') and LocalSpeechBackend.is_available():
+        try:
+            await get_speech_backend('local').warm_up()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precargar el modelo local: {str(e)}")
+    
+    logger.info(f"🔥 Precarga de backends completada en {(time.perf_counter() - started_at) * 1000:.0f} ms")
+
+async def post_init(application: Application) -> None:
+    """Registra el desglose de tiempos de arranque y lanza las tareas en segundo plano"""
+    ready_at = time.perf_counter()
+    timings = {
+        'imports': IMPORTS_DONE_AT - BOOT_STARTED_AT,
+        'configuración': startup_marks['main'] - IMPORTS_DONE_AT,
+        'construcción': startup_marks['built'] - startup_marks['main'],
+        'inicialización': ready_at - startup_marks['built'],
+        'total': ready_at - BOOT_STARTED_AT,
+    }
+    logger.info("⏱️ Arranque: " + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items()))
+    
+    if PREWARM_BACKENDS:
+        start_background_task(prewarm_backends(application))
+    
+    # Trabajadores que vacían la cola de tareas hacia Todoist
+    for _ in range(max(1, TASK_QUEUE_WORKERS)):
+        start_background_task(task_queue_worker(application))
+    
+    if isinstance(application.update_processor, PerUserUpdateProcessor):
+        start_background_task(log_dispatcher_metrics(application))
+
+async def post_shutdown(application: Application) -> None:
+    """Detiene las tareas en segundo plano y libera conexiones y procesos"""
+    # Las tareas que queden a medias en la cola se reanudan en el próximo arranque
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    
+    for queue in task_queues.values():
+        queue.close()
+    for store in token_stores.values():
+        store.close()
+    for backend in speech_backends.values():
+        backend.close()
+    todoist_clients.close_all()
+    for client in shared_todoist_clients.values():
+        client.close()
+
 def main() -> None:
     """Función principal del bot"""
-    # Crear la aplicación
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    startup_marks['main'] = time.perf_counter()
+    
+    # Crear la aplicación, procesando updates de distintos usuarios en paralelo
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(max(1, MAX_CONCURRENT_UPDATES)))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Agregar handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("tasks", tasks_command))
+    application.add_handler(CommandHandler("link", link_command))
+    application.add_handler(CommandHandler("unlink", unlink_command))
     
     # Handler para notas de voz
     application.add_handler(MessageHandler(filters.VOICE, handle_voice_message))
@@ -883,6 +2113,8 @@ def main() -> None:
     
     # Handler de errores
     application.add_error_handler(error_handler)
+    
+    startup_marks['built'] = time.perf_counter()
 
     # Iniciar el bot
     print("🤖 Bot iniciado. Presiona Ctrl+C para detener.")